@@ -3,14 +3,38 @@ import asyncio
 import os
 import json
 import time
+import tempfile
 import contextlib
+import functools
+import hashlib
+import operator
 import logging
-from typing import Tuple, Dict, List
+from pathlib import Path
+from typing import AsyncIterator, Tuple, Dict, List
 from dotenv import load_dotenv
-import websockets
+from websockets.asyncio.client import connect as ws_connect
 import lighter
 import eth_account
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # e.g. Windows
+    uvloop = None
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+else:
+    _loads = json.loads
+    _dumps = json.dumps
+
 # ---------- config ----------
 logging.disable(logging.CRITICAL)
 load_dotenv()
@@ -36,11 +60,13 @@ ORDER = SHORT        # toggle
 TP_USD = 0.10        # +$0.10 PnL
 SL_USD = 0.10        # -$0.10 PnL
 
+ACCOUNT_CACHE_PATH = Path(os.path.expanduser("~/.cache/lighterbot/accounts.json"))
+
 # ---------- utils ----------
 
 
 def next_coi() -> int:
-    return int(time.time() * 1000)
+    return time.time_ns() // 1_000_000
 
 
 def to_int_price(p: float) -> int:
@@ -56,22 +82,58 @@ def base_amount_from_notional_usd(notional_usd: float, price: float) -> int:
     return max(1, int(round(size_eth * BASE_SCALE)))
 
 
-def qty_eth_from_base_int(base_amt_int: int) -> float:
-    return base_amt_int / BASE_SCALE
+@functools.lru_cache(maxsize=None)
+def market_stats_subscribe_frame(market_id: int) -> str:
+    return _dumps({"type": "subscribe", "channel": f"market_stats/{market_id}"})
 
 # ---------- helpers ----------
 
+# a subscribe is answered with a subscribed/ snapshot, then update/ frames
+MARKET_STATS_TYPES = frozenset(("subscribed/market_stats", "update/market_stats"))
+MARKET_STATS_TAG_B = b'/market_stats"'  # matches both types, not the channel name
+_get_stats = operator.itemgetter("market_id", "mark_price")
+
+
+def load_account_cache() -> Dict[str, int]:
+    try:
+        return _loads(ACCOUNT_CACHE_PATH.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+
+def save_account_cache(cache: Dict[str, int]) -> None:
+    """Write the cache atomically (temp file + os.replace)."""
+    ACCOUNT_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=ACCOUNT_CACHE_PATH.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(_dumps(cache))
+        os.replace(tmp, ACCOUNT_CACHE_PATH)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp)
+        raise
+
 
 async def init_signer() -> Tuple[lighter.SignerClient, lighter.ApiClient, int, lighter.TransactionApi]:
     if not (BASE_URL and ETH_PRIVATE_KEY and API_KEY_PRIVATE_KEY and API_KEY_INDEX):
         raise RuntimeError("Missing keys in .env")
     api_client = lighter.ApiClient(
         configuration=lighter.Configuration(host=BASE_URL))
-    l1 = eth_account.Account.from_key(ETH_PRIVATE_KEY).address
-    resp = await lighter.AccountApi(api_client).accounts_by_l1_address(l1_address=l1)
-    if not resp.sub_accounts:
-        raise RuntimeError(f"No sub_accounts for {l1}")
-    account_index = resp.sub_accounts[0].index
+    # account_index never changes for a key, so only derive the L1 address and
+    # ask the API once per host; entries are keyed by a hash, never the raw key
+    cache = load_account_cache()
+    cache_key = hashlib.sha256(f"{BASE_URL}#{ETH_PRIVATE_KEY}".encode()).hexdigest()
+    account_index = cache.get(cache_key)
+    if account_index is None:
+        l1 = eth_account.Account.from_key(ETH_PRIVATE_KEY).address
+        resp = await lighter.AccountApi(api_client).accounts_by_l1_address(l1_address=l1)
+        if not resp.sub_accounts:
+            raise RuntimeError(f"No sub_accounts for {l1}")
+        account_index = resp.sub_accounts[0].index
+        cache[cache_key] = account_index
+        with contextlib.suppress(OSError):
+            save_account_cache(cache)
     signer = lighter.SignerClient(
         url=BASE_URL,
         private_key=API_KEY_PRIVATE_KEY,
@@ -84,25 +146,37 @@ async def init_signer() -> Tuple[lighter.SignerClient, lighter.ApiClient, int, l
     return signer, api_client, account_index, tx_api
 
 
-async def get_mark_price_once(market_id: int) -> float:
-    async with websockets.connect(WS_URL, ping_interval=None) as ws:
-        with contextlib.suppress(asyncio.TimeoutError):
-            await asyncio.wait_for(ws.recv(), timeout=2)
-        await ws.send(json.dumps({"type": "subscribe", "channel": f"market_stats/{market_id}"}))
-        while True:
-            raw = await asyncio.wait_for(ws.recv(), timeout=5)
-            msg = json.loads(raw)
-            if msg.get("type") != "update/market_stats":
-                continue
-            s = msg.get("market_stats") or {}
-            if s.get("market_id") != market_id:
+async def iter_market_stats(ws) -> AsyncIterator[dict]:
+    """Yield decoded market_stats frames; other frames are skipped without parsing."""
+    # locals for the per-frame path
+    recv, loads, tag = ws.recv, _loads, MARKET_STATS_TAG_B
+    while True:
+        # raw bytes: no str decode/UTF-8 pass, the JSON parser validates anyway
+        raw = await recv(decode=False)
+        if tag not in raw:
+            continue
+        yield loads(raw)
+
+
+async def first_mark_price(ws, market_id: int) -> float:
+    async for msg in iter_market_stats(ws):
+        try:
+            if msg["type"] not in MARKET_STATS_TYPES:
                 continue
-            mark = s.get("mark_price")
-            if mark:
-                price = float(mark)
-                with contextlib.suppress(Exception):
-                    await ws.send(json.dumps({"type": "unsubscribe", "channel": f"market_stats/{market_id}"}))
-                return price
+            mid, mark = _get_stats(msg["market_stats"])
+        except (KeyError, TypeError):
+            continue
+        if mid == market_id and mark:
+            return float(mark)
+    raise RuntimeError("market_stats stream ended before a mark price arrived")
+
+
+async def get_mark_price_once(market_id: int, timeout: float = 5) -> float:
+    async with ws_connect(WS_URL, ping_interval=None, compression=None) as ws:
+        await ws.send(market_stats_subscribe_frame(market_id))
+        # one deadline for the whole wait instead of a wait_for per frame;
+        # closing the socket drops the subscription server-side
+        return await asyncio.wait_for(first_mark_price(ws, market_id), timeout=timeout)
 
 
 def compute_prices(
@@ -118,25 +192,24 @@ def compute_prices(
     mark_int = to_int_price(mark)
 
     # IOC cap to emulate market
-    entry_price_int = int(round(mark_int * (1 + max_slippage))) if not order_is_ask \
-        else int(round(mark_int * (1 - max_slippage)))
+    slip_int = int(round(mark_int * max_slippage))
+    entry_price_int = mark_int + slip_int if not order_is_ask else mark_int - slip_int
 
-    qty_eth = qty_eth_from_base_int(base_amt_int)
-    if qty_eth <= 0:
+    if base_amt_int <= 0:
         raise RuntimeError(
             "Computed qty is zero; increase exposure or check scales.")
 
-    # PnL targets -> price deltas
-    dp_tp = tp_usd / qty_eth
-    dp_sl = sl_usd / qty_eth
+    # PnL targets -> price deltas in ticks: usd / (base_amt_int / BASE_SCALE) * PRICE_SCALE
+    dp_tp_int = int(round(tp_usd * PRICE_SCALE * BASE_SCALE / base_amt_int))
+    dp_sl_int = int(round(sl_usd * PRICE_SCALE * BASE_SCALE / base_amt_int))
 
     if not order_is_ask:  # LONG
-        tp_price_int = to_int_price(mark + dp_tp)
-        sl_price_int = to_int_price(mark - dp_sl)
+        tp_price_int = mark_int + dp_tp_int
+        sl_price_int = mark_int - dp_sl_int
         tp_is_ask = sl_is_ask = True   # sell to exit long
     else:                 # SHORT
-        tp_price_int = to_int_price(mark - dp_tp)
-        sl_price_int = to_int_price(mark + dp_sl)
+        tp_price_int = mark_int - dp_tp_int
+        sl_price_int = mark_int + dp_sl_int
         tp_is_ask = sl_is_ask = False  # buy to exit short
 
     return {
@@ -151,81 +224,75 @@ def compute_prices(
 async def compute_transactions(
     *,
     signer: lighter.SignerClient,
-    tx_api: lighter.TransactionApi,
-    account_index: int,
+    nonce: int,
     market_id: int,
     order_is_ask: bool,
     base_amt_int: int,
     prices: Dict[str, int | bool],
 ) -> List[str]:
-    """Do nonces & COIs, sign the three orders, and return the signed infos list."""
-    # nonces
-    next_nonce = await tx_api.next_nonce(account_index=account_index, api_key_index=API_KEY_INDEX)
-    nonce = next_nonce.nonce
-
+    """Do COIs, sign the three orders from `nonce` on, and return the signed infos list."""
     # COIs
     coi_base = next_coi()
     coi_entry = coi_base
     coi_tp = coi_base + 1
     coi_sl = coi_base + 2
 
-    # entry
-    entry_info, err = signer.sign_create_order(
+    # fields shared by all three orders, bound once
+    sign = functools.partial(
+        asyncio.to_thread,
+        signer.sign_create_order,
         market_index=market_id,
-        client_order_index=coi_entry,
         base_amount=base_amt_int,
-        price=prices["entry_price_int"],
-        is_ask=order_is_ask,
-        order_type=signer.ORDER_TYPE_LIMIT,
         time_in_force=signer.ORDER_TIME_IN_FORCE_GOOD_TILL_TIME,
-        reduce_only=False,
-        trigger_price=0,
-        nonce=nonce
     )
-    nonce += 1
-    if err:
-        raise RuntimeError(f"sign entry error: {err}")
 
-    # tp
-    tp_info, err = signer.sign_create_order(
-        market_index=market_id,
-        client_order_index=coi_tp,
-        base_amount=base_amt_int,
-        price=prices["tp_price_int"],
-        is_ask=prices["tp_is_ask"],  # type: ignore[arg-type]
-        order_type=signer.ORDER_TYPE_TAKE_PROFIT_LIMIT,
-        time_in_force=signer.ORDER_TIME_IN_FORCE_GOOD_TILL_TIME,
-        reduce_only=True,
-        trigger_price=prices["tp_price_int"],
-        nonce=nonce
+    # sign off the event loop; nonces are pre-assigned, so the three can run concurrently
+    (entry_info, entry_err), (tp_info, tp_err), (sl_info, sl_err) = await asyncio.gather(
+        # entry
+        sign(
+            client_order_index=coi_entry,
+            price=prices["entry_price_int"],
+            is_ask=order_is_ask,
+            order_type=signer.ORDER_TYPE_LIMIT,
+            reduce_only=False,
+            trigger_price=0,
+            nonce=nonce
+        ),
+        # tp
+        sign(
+            client_order_index=coi_tp,
+            price=prices["tp_price_int"],
+            is_ask=prices["tp_is_ask"],
+            order_type=signer.ORDER_TYPE_TAKE_PROFIT_LIMIT,
+            reduce_only=True,
+            trigger_price=prices["tp_price_int"],
+            nonce=nonce + 1
+        ),
+        # sl
+        sign(
+            client_order_index=coi_sl,
+            price=prices["sl_price_int"],
+            is_ask=prices["sl_is_ask"],
+            order_type=signer.ORDER_TYPE_STOP_LOSS_LIMIT,
+            reduce_only=True,
+            trigger_price=prices["sl_price_int"],
+            nonce=nonce + 2
+        ),
     )
-    nonce += 1
-    if err:
-        raise RuntimeError(f"sign TP error: {err}")
-
-    # sl
-    sl_info, err = signer.sign_create_order(
-        market_index=market_id,
-        client_order_index=coi_sl,
-        base_amount=base_amt_int,
-        price=prices["sl_price_int"],
-        is_ask=prices["sl_is_ask"],  # type: ignore[arg-type]
-        order_type=signer.ORDER_TYPE_STOP_LOSS_LIMIT,
-        time_in_force=signer.ORDER_TIME_IN_FORCE_GOOD_TILL_TIME,
-        reduce_only=True,
-        trigger_price=prices["sl_price_int"],
-        nonce=nonce
-    )
-    if err:
-        raise RuntimeError(f"sign SL error: {err}")
+    if entry_err:
+        raise RuntimeError(f"sign entry error: {entry_err}")
+    if tp_err:
+        raise RuntimeError(f"sign TP error: {tp_err}")
+    if sl_err:
+        raise RuntimeError(f"sign SL error: {sl_err}")
 
     return [entry_info, tp_info, sl_info]
 
 
 async def batch_tx(tx_api: lighter.TransactionApi, infos: List[str]):
-    tx_types = json.dumps(
+    tx_types = _dumps(
         [lighter.SignerClient.TX_TYPE_CREATE_ORDER] * len(infos))
-    tx_infos = json.dumps(infos)
+    tx_infos = _dumps(infos)
     return await tx_api.send_tx_batch(tx_types=tx_types, tx_infos=tx_infos)
 
 # ---------- main ----------
@@ -234,8 +301,11 @@ async def batch_tx(tx_api: lighter.TransactionApi, infos: List[str]):
 async def main():
     signer, api_client, account_index, tx_api = await init_signer()
     try:
-        # 1) mark + sizing
-        mark = await get_mark_price_once(MARKET_ID)
+        # 1) mark + nonce (independent, fetched concurrently) + sizing
+        mark, next_nonce = await asyncio.gather(
+            get_mark_price_once(MARKET_ID),
+            tx_api.next_nonce(account_index=account_index, api_key_index=API_KEY_INDEX),
+        )
         notional_usd = MARGIN * LEVERAGE
         base_amt_int = base_amount_from_notional_usd(notional_usd, mark)
 
@@ -259,8 +329,7 @@ async def main():
         # 3) sign transactions (entry + TP + SL)
         infos = await compute_transactions(
             signer=signer,
-            tx_api=tx_api,
-            account_index=account_index,
+            nonce=next_nonce.nonce,
             market_id=MARKET_ID,
             order_is_ask=ORDER,
             base_amt_int=base_amt_int,
@@ -276,4 +345,7 @@ async def main():
         await api_client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if uvloop is not None:
+        uvloop.run(main())
+    else:
+        asyncio.run(main())